@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
-import json
+import mmap
 import os
-import psycopg2
-from psycopg2.extras import execute_values
+import queue
+import threading
+from contextlib import closing
+from itertools import chain, islice
+import ijson
+import psycopg
 from dotenv import load_dotenv
 
+# Prefer the C-accelerated yajl2 parser, falling back to ijson's default backend
+try:
+    ijson_backend = ijson.get_backend("yajl2_c")
+except ImportError:
+    ijson_backend = ijson
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -15,115 +25,229 @@ DB_NAME = os.getenv("POSTGRES_DB", "leaguewordle")
 DB_USER = os.getenv("POSTGRES_USER", "postgres")
 DB_PASS = os.getenv("POSTGRES_PASSWORD", "yourpassword")
 
+# Directory where a server on this machine places its UNIX socket
+DB_SOCKET_DIR = "/var/run/postgresql"
+
+# Rows the parser thread groups into each queue item for the COPY writer,
+# trading queue hand-off overhead against rows held in memory
+BATCH_SIZE = 1000
+
+# Parsed batches allowed to wait for the COPY writer before the parser blocks
+QUEUE_SIZE = 64
+
+# Columns loaded from the JSON file, in COPY order
+PLAYER_COLUMNS = "name, team, role, region, active, year_started, nationality, image_url"
+
+def _local_socket_dir():
+    """Return the UNIX socket directory when the database runs on this machine"""
+    if DB_HOST in ("localhost", "127.0.0.1") and os.path.exists(
+        os.path.join(DB_SOCKET_DIR, f".s.PGSQL.{DB_PORT}")
+    ):
+        return DB_SOCKET_DIR
+    return None
+
+def _connect(host):
+    """Open a connection to the database through the given host or socket directory"""
+    return psycopg.connect(
+        host=host,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS
+    )
+
 def connect_to_db():
     """Connect to the PostgreSQL database"""
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = None
+        socket_dir = _local_socket_dir()
+        if socket_dir:
+            # Prefer the UNIX socket over TCP loopback; fall back to TCP if the
+            # socket is refused, e.g. when pg_hba.conf only allows peer auth there
+            try:
+                conn = _connect(socket_dir)
+            except psycopg.OperationalError:
+                pass
+        if conn is None:
+            conn = _connect(DB_HOST)
         return conn
     except Exception as e:
         print(f"Error connecting to the database: {e}")
         exit(1)
 
-def process_player_data(player):
-    """Process a player object to ensure it has all required fields"""
-    # Define default values
-    defaults = {
-        "team": "Unknown",
-        "role": "Unknown",
-        "region": "Unknown",
-        "active": True,
-        "year_started": 2010,
-        "nationality": "Unknown",
-        "image_url": None
-    }
+def player_to_tuple(player):
+    """Build a player's row in COPY column order, defaulting missing or null fields"""
+    team = player.get("team")
+    role = player.get("role")
+    region = player.get("region")
+    active = player.get("active")
+    year_started = player.get("year_started")
+    nationality = player.get("nationality")
     
-    # Merge with defaults for any missing fields
-    for key, value in defaults.items():
-        if key not in player or player[key] is None:
-            player[key] = value
+    return (
+        player.get("name"),
+        "Unknown" if team is None else team,
+        "Unknown" if role is None else role,
+        "Unknown" if region is None else region,
+        True if active is None else active,
+        2010 if year_started is None else year_started,
+        "Unknown" if nationality is None else nationality,
+        player.get("image_url")
+    )
+
+class UnsupportedJSONFormatError(Exception):
+    """Raised when the JSON document is neither a list nor an object of players"""
+
+def _json_root_char(file):
+    """Return the first non-whitespace byte of the JSON document, then rewind the file"""
+    char = file.read(1)
+    while char.isspace():
+        char = file.read(1)
+    file.seek(0)
+    return char
+
+def _has_players_key(file):
+    """Check the top-level keys of a JSON object for "players", then rewind the file"""
+    found = any(
+        prefix == "" and event == "map_key" and value == "players"
+        for prefix, event, value in ijson_backend.parse(file)
+    )
+    file.seek(0)
+    return found
+
+def iter_players(file):
+    """Stream player objects from a JSON file without loading the whole document"""
+    root = _json_root_char(file)
+    if root == b"[":
+        # JSON is an array of players
+        yield from ijson_backend.items(file, "item")
+    elif root == b"{" and _has_players_key(file):
+        # JSON has a "players" property; other top-level keys are ignored
+        yield from ijson_backend.items(file, "players.item")
+    elif root == b"{":
+        # JSON is a dictionary of player objects
+        for _, player in ijson_backend.kvitems(file, ""):
+            yield player
+    else:
+        # Let the parser report malformed input as invalid JSON first
+        for _ in ijson_backend.items(file, ""):
+            pass
+        raise UnsupportedJSONFormatError()
+
+def generate_player_rows(file):
+    """Yield player tuples in COPY column order"""
+    return map(player_to_tuple, iter_players(file))
+
+def _map_file(file):
+    """Memory-map a file so the parser reads straight from the page cache"""
+    # mmap cannot map an empty file; the parser reports it as invalid JSON instead
+    if os.fstat(file.fileno()).st_size == 0:
+        return file
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _produce_row_batches(json_file_path, batches, stop):
+    """Parse the JSON file and queue its rows in batches, ending with None"""
+    try:
+        with open(json_file_path, 'rb') as file, _map_file(file) as data:
+            rows = generate_player_rows(data)
+            while batch := list(islice(rows, BATCH_SIZE)):
+                # Stop parsing once the consumer has given up on the rows
+                if stop.is_set():
+                    return
+                batches.put(batch)
+    except Exception as e:
+        # Hand parse errors to the consumer so they are raised there
+        batches.put(e)
+        return
+    batches.put(None)
+
+def iter_row_batches(json_file_path):
+    """Yield batches of rows parsed on a producer thread, overlapping parsing with COPY"""
+    batches = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    # Daemon thread so an interrupted script never waits on the parser at exit
+    producer = threading.Thread(
+        target=_produce_row_batches,
+        args=(json_file_path, batches, stop),
+        daemon=True
+    )
+    producer.start()
     
-    return player
+    try:
+        while (batch := batches.get()) is not None:
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        # If the consumer stopped early (e.g. COPY failed), tell the producer to
+        # stop and drain the queue so a blocked put() returns; it then sees the
+        # stop flag before its next put and closes the file
+        stop.set()
+        while True:
+            try:
+                batches.get_nowait()
+            except queue.Empty:
+                break
+        producer.join()
 
 def import_players(json_file_path):
     """Import players from JSON file to PostgreSQL database"""
     try:
-        # Read JSON file
-        with open(json_file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
         # Connect to database
         conn = connect_to_db()
         cursor = conn.cursor()
         
+        # The import runs in one transaction (psycopg opens it on the first
+        # statement); skip the WAL fsync wait at commit since a failed import
+        # can simply be re-run
+        cursor.execute("SET LOCAL synchronous_commit = OFF")
+        
         # Check if the players table exists
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'players'
-            );
-        """)
-        table_exists = cursor.fetchone()[0]
+        cursor.execute("SELECT to_regclass('players')")
+        table_exists = cursor.fetchone()[0] is not None
         
         if not table_exists:
             print("The 'players' table does not exist. Please run the init-db script first.")
             conn.close()
             return
         
-        # Prepare player data for insertion
-        players_to_insert = []
-        
-        # Handle different JSON structures
-        if isinstance(data, list):
-            # JSON is an array of players
-            player_list = data
-        elif isinstance(data, dict) and "players" in data:
-            # JSON has a "players" property
-            player_list = data["players"]
-        elif isinstance(data, dict):
-            # JSON is a dictionary of player objects
-            player_list = list(data.values())
-        else:
-            print("Unsupported JSON format. Please provide a list of players or an object with a 'players' array.")
-            conn.close()
-            return
-        
-        # Process each player
-        for player in player_list:
-            processed_player = process_player_data(player)
-            
-            # Extract fields in the correct order
-            player_tuple = (
-                processed_player.get("name"),
-                processed_player.get("team"),
-                processed_player.get("role"),
-                processed_player.get("region"),
-                processed_player.get("active"),
-                processed_player.get("year_started"),
-                processed_player.get("nationality"),
-                processed_player.get("image_url")
-            )
+        # Closing the generator stops the parser thread if COPY fails part-way
+        with closing(iter_row_batches(json_file_path)) as batches:
+            # Skip if no players to insert, before creating the staging table
+            first_batch = next(batches, None)
+            if first_batch is None:
+                print("No players found in the JSON file.")
+                conn.close()
+                return
             
-            players_to_insert.append(player_tuple)
+            # COPY players into a staging table while the producer keeps parsing;
+            # seq records file order so duplicate names can be resolved below
+            cursor.execute(f"""
+                CREATE TEMP TABLE players_stage ON COMMIT DROP AS
+                SELECT {PLAYER_COLUMNS} FROM players WITH NO DATA
+            """)
+            # year_started is staged as numeric so fractional values are rounded by the
+            # INSERT's assignment cast, like the former VALUES literals were
+            cursor.execute("""
+                ALTER TABLE players_stage
+                    ADD COLUMN seq bigint GENERATED ALWAYS AS IDENTITY,
+                    ALTER COLUMN year_started TYPE numeric
+            """)
+            # Text format lets the server parse values such as "false" or "9" into
+            # the column types, as it did for the former VALUES literals
+            with cursor.copy(
+                f"COPY players_stage ({PLAYER_COLUMNS}) FROM STDIN WITH (FORMAT TEXT)"
+            ) as copy:
+                for batch in chain([first_batch], batches):
+                    for row in batch:
+                        copy.write_row(row)
         
-        # Skip if no players to insert
-        if not players_to_insert:
-            print("No players found in the JSON file.")
-            conn.close()
-            return
-        
-        # Insert players in batches
-        execute_values(
-            cursor,
-            """
-            INSERT INTO players 
-                (name, team, role, region, active, year_started, nationality, image_url)
-            VALUES %s
+        # Upsert the staged players in one statement, keeping the last
+        # occurrence of each name so ON CONFLICT never hits a row twice
+        cursor.execute(f"""
+            INSERT INTO players ({PLAYER_COLUMNS})
+            SELECT DISTINCT ON (name) {PLAYER_COLUMNS} FROM players_stage
+            ORDER BY name, seq DESC
             ON CONFLICT (name) DO UPDATE SET
                 team = EXCLUDED.team,
                 role = EXCLUDED.role,
@@ -132,20 +256,22 @@ def import_players(json_file_path):
                 year_started = EXCLUDED.year_started,
                 nationality = EXCLUDED.nationality,
                 image_url = EXCLUDED.image_url
-            """,
-            players_to_insert
-        )
+        """)
+        
+        imported_count = cursor.rowcount
         
         # Commit changes and close connection
         conn.commit()
-        print(f"Successfully imported {len(players_to_insert)} players.")
+        print(f"Successfully imported {imported_count} players.")
         
         # Close connection
         cursor.close()
         conn.close()
         
-    except json.JSONDecodeError:
+    except ijson.JSONError:
         print("Error: Invalid JSON file.")
+    except UnsupportedJSONFormatError:
+        print("Unsupported JSON format. Please provide a list of players or an object with a 'players' array.")
     except Exception as e:
         print(f"Error importing players: {e}")
 
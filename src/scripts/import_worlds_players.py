@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
-import json
+import mmap
 import os
-import datetime
-import psycopg2
-from psycopg2.extras import execute_values
+import queue
+import threading
+from contextlib import closing
+from datetime import date, datetime
+from itertools import chain, islice
+import ijson
+import orjson
+import psycopg
+from psycopg.types.json import Jsonb, set_json_dumps
 from dotenv import load_dotenv
 
+# Prefer the C-accelerated yajl2 parser, falling back to ijson's default backend
+try:
+    ijson_backend = ijson.get_backend("yajl2_c")
+except ImportError:
+    ijson_backend = ijson
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -16,126 +28,225 @@ DB_NAME = os.getenv("POSTGRES_DB", "leaguewordle")
 DB_USER = os.getenv("POSTGRES_USER", "postgres")
 DB_PASS = os.getenv("POSTGRES_PASSWORD", "yourpassword")
 
+# Directory where a server on this machine places its UNIX socket
+DB_SOCKET_DIR = "/var/run/postgresql"
+
+# Rows the parser thread groups into each queue item for the COPY writer,
+# trading queue hand-off overhead against rows held in memory
+BATCH_SIZE = 1000
+
+# Parsed batches allowed to wait for the COPY writer before the parser blocks
+QUEUE_SIZE = 64
+
+# Columns loaded from the JSON file, in COPY order
+PLAYER_COLUMNS = (
+    "name, main_name, all_names, nationality, residency, birthdate, "
+    "tournament_role, team, appearance, player_current_role, is_retired, "
+    "current_team, current_team_region"
+)
+
+def _local_socket_dir():
+    """Return the UNIX socket directory when the database runs on this machine"""
+    if DB_HOST in ("localhost", "127.0.0.1") and os.path.exists(
+        os.path.join(DB_SOCKET_DIR, f".s.PGSQL.{DB_PORT}")
+    ):
+        return DB_SOCKET_DIR
+    return None
+
+def _connect(host):
+    """Open a connection to the database through the given host or socket directory"""
+    return psycopg.connect(
+        host=host,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS
+    )
+
 def connect_to_db():
     """Connect to the PostgreSQL database"""
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = None
+        socket_dir = _local_socket_dir()
+        if socket_dir:
+            # Prefer the UNIX socket over TCP loopback; fall back to TCP if the
+            # socket is refused, e.g. when pg_hba.conf only allows peer auth there
+            try:
+                conn = _connect(socket_dir)
+            except psycopg.OperationalError:
+                pass
+        if conn is None:
+            conn = _connect(DB_HOST)
+        # Serialize jsonb values such as all_names with orjson
+        set_json_dumps(orjson.dumps, context=conn)
         return conn
     except Exception as e:
         print(f"Error connecting to the database: {e}")
         exit(1)
 
+def _parse_birthdate(value):
+    """Parse a YYYY-MM-DD birthdate, returning None if it is missing or invalid"""
+    if not value:
+        return None
+    try:
+        # Fast path for zero-padded dates; anything else goes through strptime
+        # so the accepted inputs (e.g. "1996-5-7") stay the same
+        if len(value) == 10 and value[4] == "-" and value[7] == "-":
+            try:
+                return date.fromisoformat(value)
+            except ValueError:
+                pass
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return None  # Keep as None if format is invalid
+
 def process_player_data(player_key, player_data):
-    """Process a player from the worlds_players.json format"""
+    """Convert a player from the worlds_players.json format into a COPY row tuple"""
     # Convert birthdate to proper date format or None if invalid
-    birthdate = None
-    if 'birthdate' in player_data and player_data['birthdate']:
-        try:
-            birthdate = datetime.datetime.strptime(player_data['birthdate'], '%Y-%m-%d').date()
-        except ValueError:
-            pass  # Keep as None if format is invalid
+    birthdate = _parse_birthdate(player_data.get('birthdate'))
     
     # Convert isRetired string to boolean
     is_retired = False
     if 'isRetired' in player_data:
         is_retired = player_data['isRetired'] == "1"
     
-    # Handle all_names as a JSON array
-    all_names = []
-    if 'allNames' in player_data and isinstance(player_data['allNames'], list):
-        all_names = player_data['allNames']
+    # Handle all_names as a JSON array; Jsonb serializes it with the connection's orjson dumps
+    all_names = player_data.get('allNames')
+    if not isinstance(all_names, list):
+        all_names = []
     
-    # Process the player dictionary
-    processed_player = {
-        "name": player_key,  # Use the key as the unique name
-        "main_name": player_data.get("mainName", player_key),
-        "all_names": json.dumps(all_names),
-        "nationality": player_data.get("nationality"),
-        "residency": player_data.get("Residency"),
-        "birthdate": birthdate,
-        "tournament_role": player_data.get("tournament_role"),
-        "team": player_data.get("team"),
-        "appearance": player_data.get("appearance"),
-        "player_current_role": player_data.get("current_role"),
-        "is_retired": is_retired,
-        "current_team": player_data.get("current_team"),
-        "current_team_region": player_data.get("current_team_region")
-    }
+    # Build the row in COPY column order
+    return (
+        player_key,  # Use the key as the unique name
+        player_data.get("mainName", player_key),
+        Jsonb(all_names),
+        player_data.get("nationality"),
+        player_data.get("Residency"),
+        birthdate,
+        player_data.get("tournament_role"),
+        player_data.get("team"),
+        player_data.get("appearance"),
+        player_data.get("current_role"),
+        is_retired,
+        player_data.get("current_team"),
+        player_data.get("current_team_region")
+    )
+
+def generate_player_rows(file):
+    """Stream players from a worlds_players.json file as tuples in COPY column order"""
+    for player_key, player_data in ijson_backend.kvitems(file, "", use_float=True):
+        yield process_player_data(player_key, player_data)
+
+def _map_file(file):
+    """Memory-map a file so the parser reads straight from the page cache"""
+    # mmap cannot map an empty file; the parser reports it as invalid JSON instead
+    if os.fstat(file.fileno()).st_size == 0:
+        return file
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _produce_row_batches(json_file_path, batches, stop):
+    """Parse the JSON file and queue its rows in batches, ending with None"""
+    try:
+        with open(json_file_path, 'rb') as file, _map_file(file) as data:
+            rows = generate_player_rows(data)
+            while batch := list(islice(rows, BATCH_SIZE)):
+                # Stop parsing once the consumer has given up on the rows
+                if stop.is_set():
+                    return
+                batches.put(batch)
+    except Exception as e:
+        # Hand parse errors to the consumer so they are raised there
+        batches.put(e)
+        return
+    batches.put(None)
+
+def iter_row_batches(json_file_path):
+    """Yield batches of rows parsed on a producer thread, overlapping parsing with COPY"""
+    batches = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    # Daemon thread so an interrupted script never waits on the parser at exit
+    producer = threading.Thread(
+        target=_produce_row_batches,
+        args=(json_file_path, batches, stop),
+        daemon=True
+    )
+    producer.start()
     
-    return processed_player
+    try:
+        while (batch := batches.get()) is not None:
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        # If the consumer stopped early (e.g. COPY failed), tell the producer to
+        # stop and drain the queue so a blocked put() returns; it then sees the
+        # stop flag before its next put and closes the file
+        stop.set()
+        while True:
+            try:
+                batches.get_nowait()
+            except queue.Empty:
+                break
+        producer.join()
 
 def import_worlds_players(json_file_path):
     """Import players from worlds_players.json to PostgreSQL database"""
     try:
-        # Read JSON file
-        with open(json_file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
         # Connect to database
         conn = connect_to_db()
         cursor = conn.cursor()
         
+        # The import runs in one transaction (psycopg opens it on the first
+        # statement); skip the WAL fsync wait at commit since a failed import
+        # can simply be re-run
+        cursor.execute("SET LOCAL synchronous_commit = OFF")
+        
         # Check if the players table exists
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'players'
-            );
-        """)
-        table_exists = cursor.fetchone()[0]
+        cursor.execute("SELECT to_regclass('players')")
+        table_exists = cursor.fetchone()[0] is not None
         
         if not table_exists:
             print("The 'players' table does not exist. Please run the init-db script first.")
             conn.close()
             return
         
-        # Prepare player data for insertion
-        players_to_insert = []
-        
-        # Process each player from the worlds_players.json format
-        for player_key, player_data in data.items():
-            processed_player = process_player_data(player_key, player_data)
+        # Closing the generator stops the parser thread if COPY fails part-way
+        with closing(iter_row_batches(json_file_path)) as batches:
+            # Skip if no players to insert, before creating the staging table
+            first_batch = next(batches, None)
+            if first_batch is None:
+                print("No players found in the JSON file.")
+                conn.close()
+                return
             
-            # Extract fields in the correct order
-            player_tuple = (
-                processed_player["name"],
-                processed_player["main_name"],
-                processed_player["all_names"],
-                processed_player["nationality"],
-                processed_player["residency"],
-                processed_player["birthdate"],
-                processed_player["tournament_role"],
-                processed_player["team"],
-                processed_player["appearance"],
-                processed_player["player_current_role"],
-                processed_player["is_retired"],
-                processed_player["current_team"],
-                processed_player["current_team_region"]
-            )
-            
-            players_to_insert.append(player_tuple)
-        
-        # Skip if no players to insert
-        if not players_to_insert:
-            print("No players found in the JSON file.")
-            conn.close()
-            return
+            # COPY players into a staging table while the producer keeps parsing;
+            # seq records file order so duplicate names can be resolved below
+            cursor.execute(f"""
+                CREATE TEMP TABLE players_stage ON COMMIT DROP AS
+                SELECT {PLAYER_COLUMNS} FROM players WITH NO DATA
+            """)
+            # appearance is staged as numeric so fractional values are rounded by the
+            # INSERT's assignment cast, like the former VALUES literals were
+            cursor.execute("""
+                ALTER TABLE players_stage
+                    ADD COLUMN seq bigint GENERATED ALWAYS AS IDENTITY,
+                    ALTER COLUMN appearance TYPE numeric
+            """)
+            # Text format lets the server parse values such as "false" or "9" into
+            # the column types, as it did for the former VALUES literals
+            with cursor.copy(
+                f"COPY players_stage ({PLAYER_COLUMNS}) FROM STDIN WITH (FORMAT TEXT)"
+            ) as copy:
+                for batch in chain([first_batch], batches):
+                    for row in batch:
+                        copy.write_row(row)
         
-        # Insert players in batches
-        execute_values(
-            cursor,
-            """
-            INSERT INTO players 
-                (name, main_name, all_names, nationality, residency, birthdate, 
-                tournament_role, team, appearance, player_current_role, is_retired, 
-                current_team, current_team_region)
-            VALUES %s
+        # Upsert the staged players in one statement, keeping the last
+        # occurrence of each name so ON CONFLICT never hits a row twice
+        cursor.execute(f"""
+            INSERT INTO players ({PLAYER_COLUMNS})
+            SELECT DISTINCT ON (name) {PLAYER_COLUMNS} FROM players_stage
+            ORDER BY name, seq DESC
             ON CONFLICT (name) DO UPDATE SET
                 main_name = EXCLUDED.main_name,
                 all_names = EXCLUDED.all_names,
@@ -149,19 +260,19 @@ def import_worlds_players(json_file_path):
                 is_retired = EXCLUDED.is_retired,
                 current_team = EXCLUDED.current_team,
                 current_team_region = EXCLUDED.current_team_region
-            """,
-            players_to_insert
-        )
+        """)
+        
+        imported_count = cursor.rowcount
         
         # Commit changes and close connection
         conn.commit()
-        print(f"Successfully imported {len(players_to_insert)} players.")
+        print(f"Successfully imported {imported_count} players.")
         
         # Close connection
         cursor.close()
         conn.close()
         
-    except json.JSONDecodeError:
+    except ijson.JSONError:
         print("Error: Invalid JSON file.")
     except Exception as e:
         print(f"Error importing players: {e}")